@@ -1,4 +1,6 @@
 import argparse
+import itertools
+import logging
 import pathlib
 import re
 import sys
@@ -74,6 +76,9 @@ def mock_get_artefact_urls(mocker):
 def mock_builder(
     mock_cli_args, mock_set_lp_creds, mock_read_rockcraft_yaml, mock_lp_login
 ):
+    mock_cli_args.return_value.parse_args.return_value.history_db = ":memory:"
+    mock_cli_args.return_value.parse_args.return_value.series = None
+    mock_cli_args.return_value.parse_args.return_value.profile_dir = None
     return rockcraft_lpci_build.RockcraftLpciBuilds()
 
 
@@ -120,6 +125,7 @@ class TestRockcraftLpciBuilds:
     def test_attributes(
         self, mock_cli_args, mock_set_lp_creds, mock_read_rockcraft_yaml, mock_lp_login
     ):
+        mock_cli_args.return_value.parse_args.return_value.profile_dir = None
         obj = rockcraft_lpci_build.RockcraftLpciBuilds()
         mock_cli_args.assert_called_once()
         mock_set_lp_creds.assert_called_once()
@@ -133,6 +139,7 @@ class TestRockcraftLpciBuilds:
         assert obj.lp_repo_name
         assert obj.lp_repo_path
         assert obj.lp_repo == obj.lp_local_repo == obj.lp_local_repo_path == None
+        assert obj.commit_sha == obj.lp_token_expiry == None
         assert obj.target_build_count == 0
 
     def test_cli_args_missing_args(self):
@@ -151,15 +158,23 @@ class TestRockcraftLpciBuilds:
         )
         mock_lp_client.git_repositories.getByPath.assert_called_once_with(path="foo")
 
-    def test_save_build_logs(self, mock_ci_build, mock_requests, mock_tempfile):
+    @patch(
+        "rockcraft_lpci_build.rockcraft_lpci_build.BuildLogAnalyzer.analyze_build_log"
+    )
+    def test_save_build_logs(
+        self, mock_analyze_build_log, mock_ci_build, mock_requests, mock_tempfile
+    ):
         mock_ci_build.build_log_url = None
         rockcraft_lpci_build.RockcraftLpciBuilds.save_build_logs(mock_ci_build)
         mock_requests.assert_not_called()
 
         mock_ci_build.build_log_url = "foo"
+        mock_ci_build.distro_arch_series_link = "ubuntu/noble/amd64"
         rockcraft_lpci_build.RockcraftLpciBuilds.save_build_logs(mock_ci_build)
         mock_requests.get.assert_called_once_with("foo")
         mock_tempfile.NamedTemporaryFile.assert_called_once_with(delete=False)
+        mock_analyze_build_log.assert_called_once()
+        assert mock_analyze_build_log.call_args.args[1:] == ("noble", "amd64")
 
     def test_get_artefact_urls(self, mock_ci_build):
         mock_ci_build.distro_arch_series_link = "foo/bar"
@@ -188,12 +203,13 @@ class TestRockcraftLpciBuilds:
         mock_requests.assert_not_called()
         mock_get_artefact_urls.assert_not_called()
 
-        mock_builder.download_build_artefacts(successful_builds=["foo"])
-        mock_get_artefact_urls.assert_called_once_with("foo")
+        build = MagicMock(distro_arch_series_link="ubuntu/jammy/amd64")
+        mock_builder.download_build_artefacts(successful_builds=[build])
+        mock_get_artefact_urls.assert_called_once_with(build)
 
         mock_get_artefact_urls.return_value = ["url"]
         with patch("builtins.open", mock_open()) as m:
-            mock_builder.download_build_artefacts(successful_builds=["foo"])
+            mock_builder.download_build_artefacts(successful_builds=[build])
             mock_requests.get.assert_called_once_with("url")
             mock_requests.raise_for_status.aassert_called_once()
             m.assert_called_once_with("url", "wb")
@@ -275,10 +291,12 @@ class TestRockcraftLpciBuilds:
         mock_repo,
     ):
         mock_builder.lp_creds = "creds"
+        mock_builder.args.state_file = "state.json"
         mock_builder.prepare_local_project()
         mock_mkdtemp.assert_called_once()
         mock_getcwd.assert_called_once()
         mock_copytree.assert_called_once()
+        assert mock_copytree.call_args.kwargs["ignore"]
         mock_rmtree.assert_not_called()
         mock_remove.assert_not_called()
         mock_repo.init.assert_called_once()
@@ -332,6 +350,69 @@ class TestRockcraftLpciBuilds:
                     )
                     dump.assert_called_once()
 
+    @patch("distro_info.UbuntuDistroInfo.devel")
+    def test_write_lpci_configuration_file_series_matrix(
+        self, mock_distro_info_devel, mock_builder, mock_get_rock_archs, tmp_path
+    ):
+        mock_distro_info_devel.return_value = "plucky"
+        mock_get_rock_archs.return_value = ["amd64", "arm64"]
+        mock_builder.rockcraft_yaml_raw = {"base": "ubuntu@22.04"}
+        # Duplicates only get one job
+        mock_builder.args.series = [
+            "ubuntu@22.04",
+            "ubuntu@24.04",
+            "devel",
+            "ubuntu:24.04",
+        ]
+        mock_builder.lp_local_repo_path = str(tmp_path)
+        mock_builder.write_lpci_configuration_file()
+
+        assert mock_builder.series_matrix == ["jammy", "noble", "plucky"]
+        assert mock_builder.target_build_count == 6
+        lpci_config = rockcraft_lpci_build.yaml.safe_load(
+            (tmp_path / ".launchpad.yaml").read_text()
+        )
+        assert lpci_config["pipeline"] == [
+            ["build-rock-jammy", "build-rock-noble", "build-rock-plucky"]
+        ]
+        noble = lpci_config["jobs"]["build-rock-noble"]
+        assert noble["series"] == "noble"
+        assert noble["architectures"] == ["amd64", "arm64"]
+        assert noble["run"].startswith(
+            "sed -i -E 's/^base:.*/base: ubuntu@24.04/' rockcraft.yaml\n"
+        )
+        assert "rockcraft pack" in noble["run"]
+        assert lpci_config["jobs"]["build-rock-plucky"]["run"].startswith(
+            "echo 'build-base: devel' >> rockcraft.yaml\n"
+        )
+
+    def test_get_base_override_script(self, mock_builder):
+        mock_builder.rockcraft_yaml_raw = {"base": "bare", "build-base": "ubuntu@22.04"}
+        assert mock_builder.get_base_override_script("ubuntu@24.04") == (
+            "sed -i -E 's/^build-base:.*/build-base: ubuntu@24.04/' rockcraft.yaml\n"
+        )
+
+        mock_builder.rockcraft_yaml_raw = {"base": "bare"}
+        assert mock_builder.get_base_override_script("ubuntu@24.04") == (
+            "echo 'build-base: ubuntu@24.04' >> rockcraft.yaml\n"
+        )
+
+    def test_download_build_artefacts_series_matrix(
+        self, mock_builder, mock_requests, mock_get_artefact_urls, tmp_path, monkeypatch
+    ):
+        monkeypatch.chdir(tmp_path)
+        mock_builder.series_matrix = ["jammy", "noble"]
+        mock_get_artefact_urls.return_value = ["https://lp/rock_1.0_amd64.rock"]
+        mock_requests.get.return_value.content = b"rock"
+        mock_builder.download_build_artefacts(
+            [
+                MagicMock(distro_arch_series_link="ubuntu/jammy/amd64"),
+                MagicMock(distro_arch_series_link="ubuntu/noble/amd64"),
+            ]
+        )
+        assert (tmp_path / "jammy" / "amd64" / "rock_1.0_amd64.rock").exists()
+        assert (tmp_path / "noble" / "amd64" / "rock_1.0_amd64.rock").exists()
+
     def test_get_lp_token(self, mock_builder):
         mock_builder.args.timeout = 0
         mock_builder.lp_repo = MagicMock()
@@ -351,6 +432,112 @@ class TestRockcraftLpciBuilds:
             "origin", url="url"
         )
         origin.push.assert_called_once()
+        assert mock_builder.commit_sha == mock_builder.lp_local_repo.head.commit.hexsha
+
+    def test_save_and_load_run_state(self, mock_builder, tmp_path):
+        mock_builder.args.state_file = str(tmp_path / "state.json")
+        mock_builder.rock_name = "rock"
+        mock_builder.commit_sha = "abc"
+        mock_builder.target_build_count = 2
+        mock_builder.lp_token_expiry = "2024-01-01T00:00:00+00:00"
+        mock_builder.save_run_state()
+
+        run_state = mock_builder.load_run_state()
+        assert run_state["lp_repo_path"] == mock_builder.lp_repo_path
+        assert run_state["commit_sha"] == "abc"
+        assert run_state["target_build_count"] == 2
+
+        mock_builder.rock_name = "other"
+        with pytest.raises(ValueError):
+            mock_builder.load_run_state()
+
+        mock_builder.args.state_file = str(tmp_path / "missing.json")
+        with pytest.raises(FileNotFoundError):
+            mock_builder.load_run_state()
+
+    def test_reattach_to_lp_builds(self, mock_builder, mock_atexit):
+        run_state = {
+            "lp_repo_name": "repo",
+            "lp_repo_path": "~user/+git/repo",
+            "commit_sha": "abc",
+            "target_build_count": 3,
+            "lp_token_expiry": "2024-01-01T00:00:00+00:00",
+        }
+        with patch.object(mock_builder, "load_run_state", return_value=run_state):
+            mock_builder.reattach_to_lp_builds()
+        mock_builder.launchpad.git_repositories.getByPath.assert_called_once_with(
+            path="~user/+git/repo"
+        )
+        assert mock_builder.commit_sha == "abc"
+        assert mock_builder.target_build_count == 3
+
+        mock_builder.launchpad.git_repositories.getByPath.return_value = None
+        with patch.object(
+            mock_builder, "load_run_state", return_value=run_state
+        ), patch.object(mock_builder, "delete_run_state") as delete_run_state:
+            with pytest.raises(SystemExit):
+                mock_builder.reattach_to_lp_builds()
+            delete_run_state.assert_called_once()
+
+    def test_run_resume(self, mock_builder, mock_atexit):
+        mock_builder.args.resume = True
+        with patch.multiple(
+            mock_builder,
+            reattach_to_lp_builds=DEFAULT,
+            prepare_local_project=DEFAULT,
+            wait_for_lp_builds=DEFAULT,
+            download_build_artefacts=DEFAULT,
+        ) as mocks:
+            mocks["wait_for_lp_builds"].return_value = ["build"]
+            mock_builder.run()
+            mock_atexit.register.assert_any_call(mock_builder.cleanup)
+            mock_atexit.register.assert_any_call(mock_builder.save_build_history)
+            mocks["reattach_to_lp_builds"].assert_called_once()
+            mocks["prepare_local_project"].assert_not_called()
+            mocks["download_build_artefacts"].assert_called_once_with(["build"])
+
+    @pytest.mark.parametrize(
+        "error, keep_lp_repo",
+        [
+            (KeyboardInterrupt, True),
+            (rockcraft_lpci_build.LaunchpadBuildTimeout, True),
+            (ConnectionError, True),
+            (rockcraft_lpci_build.LaunchpadBuildFailure, False),
+        ],
+    )
+    def test_run_interrupted(
+        self, mock_builder, mock_atexit, tmp_path, error, keep_lp_repo
+    ):
+        mock_builder.args.resume = True
+        mock_builder.args.state_file = str(tmp_path / "state.json")
+        mock_builder.commit_sha = "abc"
+        (tmp_path / "state.json").write_text("{}")
+        with patch.multiple(
+            mock_builder, reattach_to_lp_builds=DEFAULT, wait_for_lp_builds=DEFAULT
+        ) as mocks:
+            mocks["wait_for_lp_builds"].side_effect = error
+            with pytest.raises(error):
+                mock_builder.run()
+            assert mock_builder.keep_lp_repo == keep_lp_repo
+
+    def test_cleanup(self, mock_builder):
+        with patch.multiple(
+            mock_builder, delete_git_repository=DEFAULT, delete_run_state=DEFAULT
+        ) as mocks:
+            mock_builder.cleanup()
+            mocks["delete_git_repository"].assert_not_called()
+
+            mock_builder.lp_repo = MagicMock()
+            mock_builder.keep_lp_repo = True
+            mock_builder.cleanup()
+            mocks["delete_git_repository"].assert_not_called()
+
+            mock_builder.keep_lp_repo = False
+            mock_builder.cleanup()
+            mocks["delete_git_repository"].assert_called_once_with(
+                mock_builder.launchpad, mock_builder.lp_repo_path
+            )
+            mocks["delete_run_state"].assert_called_once()
 
     def test_wait_for_lp_builds(self, mock_builder, mock_atexit):
         # TODO: missing tests for multiple scenarios
@@ -360,3 +547,744 @@ class TestRockcraftLpciBuilds:
         mock_builder.lp_repo.getStatusReports.return_value = []
         mock_builder.wait_for_lp_builds()
         mock_builder.lp_repo.getStatusReports.assert_called_once()
+
+    def test_is_build_finished(self, mock_ci_build):
+        mock_ci_build.buildstate = "Currently building"
+        assert not rockcraft_lpci_build.RockcraftLpciBuilds.is_build_finished(
+            mock_ci_build
+        )
+        mock_ci_build.buildstate = "Failed to build"
+        assert rockcraft_lpci_build.RockcraftLpciBuilds.is_build_finished(mock_ci_build)
+
+    def test_cancel_in_progress_builds(self, mock_builder, caplog):
+        now = rockcraft_lpci_build.datetime.now(rockcraft_lpci_build.timezone.utc)
+        failed = MagicMock(
+            date_started=now - rockcraft_lpci_build.timedelta(minutes=10),
+            date_finished=now,
+        )
+        running = MagicMock(
+            buildstate="Currently building",
+            can_be_cancelled=True,
+            distro_arch_series_link="ubuntu/jammy/arm64",
+            date_started=now - rockcraft_lpci_build.timedelta(minutes=4),
+            date_finished=None,
+        )
+        queued = MagicMock(
+            buildstate="Needs building",
+            can_be_cancelled=True,
+            distro_arch_series_link="ubuntu/jammy/amd64",
+            date_started=None,
+        )
+        done = MagicMock(buildstate="Successfully built")
+        mock_builder.launchpad.load.side_effect = [
+            running,
+            queued,
+            done,
+            Exception("API error"),
+        ]
+
+        # Only arm64 has a build history, of 20min builds
+        with patch.object(
+            mock_builder,
+            "get_expected_time",
+            side_effect=lambda column, series, arch: (
+                1200.0 if arch == "arm64" else None
+            ),
+        ), caplog.at_level(logging.INFO):
+            saved = mock_builder.cancel_in_progress_builds(
+                ["running", "queued", "done", "broken"],
+                [failed],
+            )
+        running.cancel.assert_called_once()
+        queued.cancel.assert_called_once()
+        done.cancel.assert_not_called()
+        # 16min for arm64, from its history, and 10min for amd64, from the
+        # failed build
+        assert (
+            rockcraft_lpci_build.timedelta(minutes=25, seconds=59)
+            < saved
+            <= rockcraft_lpci_build.timedelta(minutes=26)
+        )
+        assert "[broken] Failed to cancel build" in caplog.text
+        assert "lower bound" in caplog.text
+
+        # The failed build never started: amd64 can't be estimated
+        caplog.clear()
+        failed.date_started = None
+        mock_builder.launchpad.load.side_effect = [running, queued]
+        with patch.object(
+            mock_builder,
+            "get_expected_time",
+            side_effect=lambda column, series, arch: (
+                1200.0 if arch == "arm64" else None
+            ),
+        ), caplog.at_level(logging.INFO):
+            saved = mock_builder.cancel_in_progress_builds(
+                ["running", "queued"], [failed]
+            )
+        assert (
+            rockcraft_lpci_build.timedelta(minutes=15, seconds=59)
+            < saved
+            <= rockcraft_lpci_build.timedelta(minutes=16)
+        )
+        assert "lower bound" not in caplog.text
+        assert "not counting 1 build(s)" in caplog.text
+
+    def test_wait_for_lp_builds_cancels_siblings_on_failure(
+        self, mock_builder, mock_atexit
+    ):
+        mock_builder.args.timeout = 60
+        mock_builder.args.allow_build_failures = False
+        mock_builder.target_build_count = 2
+        mock_builder.lp_local_repo = MagicMock()
+        mock_builder.lp_repo = MagicMock()
+        mock_builder.lp_repo.getStatusReports.return_value = [
+            MagicMock(ci_build_link="amd64"),
+            MagicMock(ci_build_link="arm64"),
+        ]
+        failed = MagicMock(
+            arch_tag="amd64",
+            buildstate="Failed to build",
+            distro_arch_series_link="ubuntu/jammy/amd64",
+        )
+        mock_builder.launchpad.load.return_value = failed
+        with patch.object(mock_builder, "save_build_logs"), patch.object(
+            mock_builder, "cancel_in_progress_builds"
+        ) as cancel:
+            with pytest.raises(rockcraft_lpci_build.LaunchpadBuildFailure):
+                mock_builder.wait_for_lp_builds()
+            cancel.assert_called_once()
+            assert cancel.call_args.args[0] == ["arm64"]
+            assert cancel.call_args.args[1] == [failed]
+
+
+@pytest.fixture()
+def mock_local_builder(mocker):
+    mock_cli_args = mocker.patch(
+        "rockcraft_lpci_build.rockcraft_lpci_build.RockcraftLocalBuilds.cli_args"
+    )
+    mock_cli_args.return_value.parse_args.return_value.profile_dir = None
+    mocker.patch(
+        "rockcraft_lpci_build.rockcraft_lpci_build.RockcraftLocalBuilds.read_rockcraft_yaml"
+    )
+    builder = rockcraft_lpci_build.RockcraftLocalBuilds()
+    builder.host_arch = "amd64"
+    builder.rockcraft_yaml_raw = {
+        "base": "ubuntu@22.04",
+        "platforms": {"amd64": None, "arm64": None, "foo": {"build-for": "amd64"}},
+    }
+    builder.args.history_db = ":memory:"
+    builder.args.series = None
+    builder.args.timeout = 5
+    builder.args.local_concurrency = 2
+    builder.args.allow_build_failures = False
+    return builder
+
+
+class TestRockcraftLocalBuilds:
+    def test_get_local_platforms(self, mock_local_builder):
+        assert mock_local_builder.get_local_platforms() == ["amd64", "foo"]
+
+    def test_submit_builds(self, mock_local_builder):
+        mock_local_builder.host_arch = "s390x"
+        assert not mock_local_builder.submit_builds()
+
+        mock_local_builder.host_arch = "amd64"
+        with patch.multiple(
+            mock_local_builder, prepare_build_dir=DEFAULT, pack=DEFAULT
+        ) as mocks:
+            assert mock_local_builder.submit_builds()
+            mock_local_builder.wait_for_builds()
+            assert mock_local_builder.target_build_count == 2
+            assert mocks["prepare_build_dir"].call_count == 2
+            mocks["pack"].assert_has_calls([call("amd64"), call("foo")])
+
+        # All build dirs are ready before the first build starts
+        steps = []
+        with patch.multiple(
+            mock_local_builder,
+            prepare_build_dir=lambda platf: steps.append(("prepare", platf)),
+            pack=lambda platf: steps.append(("pack", platf)),
+        ):
+            mock_local_builder.submit_builds()
+            mock_local_builder.wait_for_builds()
+        assert [step for step, _ in steps] == ["prepare", "prepare", "pack", "pack"]
+
+    def test_prepare_build_dir(self, mock_local_builder, tmp_path, monkeypatch):
+        project = tmp_path / "project"
+        (project / "profiles").mkdir(parents=True)
+        (project / "profiles" / "phase.prof").write_text("")
+        (project / "src" / "profiles").mkdir(parents=True)
+        (project / "rock_1.0_amd64.rock").write_text("")
+        monkeypatch.chdir(project)
+        mock_local_builder.profiler = rockcraft_lpci_build.PhaseProfiler("profiles", 5)
+        build_dir = pathlib.Path(mock_local_builder.prepare_build_dir("amd64"))
+        try:
+            assert sorted(p.name for p in build_dir.rglob("*")) == [
+                "profiles",
+                "src",
+            ]
+            assert (build_dir / "src" / "profiles").is_dir()
+        finally:
+            rockcraft_lpci_build.shutil.rmtree(build_dir)
+
+    def test_pack(self, mock_local_builder, tmp_path):
+        mock_local_builder.run_id = "run"
+        mock_local_builder.build_dirs["amd64"] = str(tmp_path)
+        mock_local_builder.submitted_at = rockcraft_lpci_build.time.monotonic()
+        with patch("subprocess.Popen") as popen, patch.object(
+            rockcraft_lpci_build.BuildLogAnalyzer, "analyze_build_log"
+        ) as analyze_build_log:
+            popen.return_value.wait.return_value = 0
+            assert mock_local_builder.pack("amd64") == "amd64"
+            assert popen.call_args.args[0][-1] == "--platform=amd64"
+            assert popen.call_args.kwargs["cwd"] == str(tmp_path)
+            analyze_build_log.assert_called_once_with(
+                f"{tmp_path}.log", mock_local_builder.build_series, "amd64"
+            )
+            assert mock_local_builder.build_records["run/amd64"]["outcome"] == (
+                "success"
+            )
+
+            popen.return_value.wait.return_value = 1
+            with pytest.raises(rockcraft_lpci_build.BuildFailure):
+                mock_local_builder.pack("amd64")
+
+            mock_local_builder.executor = MagicMock()
+            popen.return_value.poll.return_value = None
+            popen.return_value.wait.side_effect = lambda: (
+                mock_local_builder.cancel_in_progress_builds() or -15
+            )
+            with pytest.raises(rockcraft_lpci_build.BuildFailure):
+                mock_local_builder.pack("amd64")
+            popen.return_value.terminate.assert_called_once()
+            assert mock_local_builder.build_records["run/amd64"]["outcome"] == (
+                "cancelled"
+            )
+            popen.reset_mock()
+            with pytest.raises(rockcraft_lpci_build.BuildFailure):
+                mock_local_builder.pack("amd64")
+            popen.assert_not_called()
+
+    def test_wait_for_builds(self, mock_local_builder):
+        def pack(platf):
+            if platf == "foo":
+                raise rockcraft_lpci_build.BuildFailure()
+            return platf
+
+        with patch.multiple(mock_local_builder, prepare_build_dir=DEFAULT, pack=pack):
+            mock_local_builder.submit_builds()
+            with patch.object(
+                mock_local_builder, "cancel_in_progress_builds"
+            ) as cancel:
+                with pytest.raises(rockcraft_lpci_build.BuildFailure):
+                    mock_local_builder.wait_for_builds()
+                cancel.assert_called_once()
+
+            mock_local_builder.args.allow_build_failures = True
+            assert mock_local_builder.wait_for_builds() == ["amd64"]
+
+    def test_wait_for_builds_timeout(self, mock_local_builder):
+        mock_local_builder.args.timeout = 0
+        release = rockcraft_lpci_build.threading.Event()
+        with patch.multiple(
+            mock_local_builder,
+            prepare_build_dir=DEFAULT,
+            pack=lambda platf: release.wait(),
+        ):
+            mock_local_builder.submit_builds()
+            with patch.object(
+                mock_local_builder,
+                "cancel_in_progress_builds",
+                side_effect=release.set,
+            ) as cancel:
+                with pytest.raises(rockcraft_lpci_build.BuildTimeout):
+                    mock_local_builder.wait_for_builds()
+                cancel.assert_called_once()
+
+    def test_wait_for_builds_checks_overrun(self, mock_local_builder, monkeypatch):
+        monkeypatch.setattr(rockcraft_lpci_build, "DEFAULT_POLL_INTERVAL", 0.01)
+        release = rockcraft_lpci_build.threading.Event()
+
+        def pack(platf):
+            mock_local_builder.build_started_at[platf] = (
+                rockcraft_lpci_build.time.monotonic() - 3600
+            )
+            release.wait(5)
+            return platf
+
+        with patch.multiple(
+            mock_local_builder, prepare_build_dir=DEFAULT, pack=pack
+        ), patch.object(
+            mock_local_builder,
+            "check_build_overrun",
+            side_effect=lambda *args: release.set(),
+        ) as check_build_overrun:
+            mock_local_builder.submit_builds()
+            assert sorted(mock_local_builder.wait_for_builds()) == ["amd64", "foo"]
+
+        series, arch, elapsed = check_build_overrun.call_args.args
+        assert (series, arch) == ("jammy", "amd64")
+        assert elapsed >= 3600
+
+    def test_download_build_artefacts(self, mock_local_builder, tmp_path):
+        build_dir = tmp_path / "build"
+        build_dir.mkdir()
+        (build_dir / "rock_1.0_amd64.rock").write_text("rock")
+        mock_local_builder.build_dirs["amd64"] = str(build_dir)
+        with patch("shutil.copy2") as copy2:
+            mock_local_builder.download_build_artefacts(["amd64"])
+            copy2.assert_called_once_with(
+                build_dir / "rock_1.0_amd64.rock", "rock_1.0_amd64.rock"
+            )
+
+    def test_build_records_per_platform(self, mock_local_builder, tmp_path):
+        for platf in ["amd64", "foo"]:
+            build_dir = tmp_path / platf
+            build_dir.mkdir()
+            (build_dir / f"rock_1.0_{platf}.rock").write_text(platf)
+            mock_local_builder.build_dirs[platf] = str(build_dir)
+            mock_local_builder.record_build(
+                mock_local_builder.get_build_key(platf),
+                "ubuntu@22.04",
+                "amd64",
+                "success",
+                0.0,
+                60.0,
+            )
+
+        with patch("shutil.copy2"):
+            mock_local_builder.download_build_artefacts(["amd64", "foo"])
+
+        records = mock_local_builder.build_records.values()
+        assert sorted(r["artefact_size"] for r in records) == [3, 5]
+        assert len({r["build_key"] for r in records}) == 2
+
+    def test_cleanup(self, mock_local_builder, tmp_path):
+        build_dir = tmp_path / "build"
+        build_dir.mkdir()
+        mock_local_builder.build_dirs["amd64"] = str(build_dir)
+        mock_local_builder.cleanup()
+        assert not build_dir.exists()
+
+
+class TestRockcraftBuildPlanner:
+    @pytest.fixture()
+    def monorepo(self, tmp_path, monkeypatch):
+        for project, parts in [
+            ("foo/1.0", {}),
+            ("foo/1.1", {"shared": {"plugin": "dump", "source": "../../common"}}),
+            ("bar", {"remote": {"plugin": "nil", "source": "https://a.b/c.git"}}),
+        ]:
+            (tmp_path / project).mkdir(parents=True)
+            (tmp_path / project / "rockcraft.yaml").write_text(
+                rockcraft_lpci_build.yaml.dump(
+                    {
+                        "name": project.split("/")[0],
+                        "base": "ubuntu@22.04",
+                        "platforms": {"amd64": None},
+                        "parts": parts,
+                    }
+                )
+            )
+        (tmp_path / "common").mkdir()
+        (tmp_path / "common" / "file").write_text("v1")
+
+        repo = rockcraft_lpci_build.Repo.init(tmp_path)
+        with repo.config_writer() as config:
+            config.set_value("user", "name", "test")
+            config.set_value("user", "email", "test@example.com")
+        repo.git.add(A=True)
+        repo.git.commit(m="init")
+        monkeypatch.chdir(tmp_path / "foo")
+        return repo
+
+    def test_get_local_part_sources(self, monorepo, monkeypatch):
+        monkeypatch.chdir(monorepo.working_tree_dir)
+        project = rockcraft_lpci_build.RockcraftProject(
+            pathlib.Path("foo/1.1/rockcraft.yaml")
+        )
+        assert project.get_local_part_sources() == [pathlib.Path("common")]
+
+        project = rockcraft_lpci_build.RockcraftProject(
+            pathlib.Path("bar/rockcraft.yaml")
+        )
+        assert project.get_local_part_sources() == []
+
+    def test_is_affected(self):
+        deps = [pathlib.Path("foo/1.0"), pathlib.Path("common")]
+        is_affected = rockcraft_lpci_build.RockcraftBuildPlanner.is_affected
+        assert is_affected(pathlib.Path("foo/1.0/rockcraft.yaml"), deps)
+        assert is_affected(pathlib.Path("common"), deps)
+        assert not is_affected(pathlib.Path("foo/1.1/rockcraft.yaml"), deps)
+        assert not is_affected(pathlib.Path("common2/file"), deps)
+
+    @patch("distro_info.UbuntuDistroInfo.get_all")
+    def test_get_build_matrix(self, mock_distro_info_get_all, monorepo, capsys):
+        mock_distro_info_get_all.return_value = ["Ubuntu 22.04 LTS", "Ubuntu 24.04"]
+        (pathlib.Path(monorepo.working_tree_dir) / "common" / "file").write_text("v2")
+        monorepo.git.commit(a=True, m="change common")
+
+        planner = rockcraft_lpci_build.RockcraftBuildPlanner("HEAD~1...HEAD")
+        planner.run()
+        matrix = rockcraft_lpci_build.json.loads(capsys.readouterr().out)
+        assert matrix == {
+            "include": [
+                {
+                    "name": "foo",
+                    "path": "foo/1.1",
+                    "base": "Ubuntu 22.04 LTS",
+                    "archs": ["amd64"],
+                }
+            ]
+        }
+
+
+TRACE_LOG = """\
+[build-rock] Running lpci
+2024-05-02 10:00:00.000 Starting rockcraft
+2024-05-02 10:00:01.000 Pulling pebble
+2024-05-02 10:00:03.000 Fetching stage-packages
+2024-05-02 10:00:04.500 some unrelated trace message
+2024-05-02 10:00:08.000 Pulling my-part
+2024-05-02 10:00:09.000 Building pebble
+2024-05-02 10:00:19.000 Staging pebble
+2024-05-02 10:00:20.000 Priming pebble
+2024-05-02 10:00:21.000 Creating new layer
+2024-05-02 10:00:25.000 Exporting to OCI archive
+2024-05-02 10:00:29.000 Exported to OCI archive 'rock_1.0_amd64.rock'
+2024-05-02 10:00:30.000 Done
+"""
+
+
+class TestBuildLogAnalyzer:
+    def test_report(self):
+        analyzer = rockcraft_lpci_build.BuildLogAnalyzer()
+        for line in TRACE_LOG.splitlines():
+            analyzer.feed(line)
+
+        assert analyzer.report() == {
+            "parts": {
+                "pebble": {
+                    "pulling": 2.0,
+                    "building": 10.0,
+                    "staging": 1.0,
+                    "priming": 1.0,
+                },
+                "my-part": {"pulling": 1.0},
+            },
+            "package_download": 5.0,
+            "oci_image": 8.0,
+            "total": 30.0,
+        }
+
+    def test_analyze_build_log(self, tmp_path):
+        log_path = tmp_path / "build.log"
+        log_path.write_text(TRACE_LOG)
+        report = rockcraft_lpci_build.BuildLogAnalyzer.analyze_build_log(
+            str(log_path), "jammy", "amd64"
+        )
+        saved = rockcraft_lpci_build.json.loads(
+            (tmp_path / "build.log.timings.json").read_text()
+        )
+        assert saved == {"series": "jammy", "arch": "amd64", **report}
+
+        table = rockcraft_lpci_build.BuildLogAnalyzer.format_report(
+            report, "jammy", "amd64"
+        )
+        assert table.startswith("Build time breakdown for jammy/amd64:")
+        assert "pebble: building" in table
+        assert re.search(r"total\s+30\.000s", table)
+
+        assert not rockcraft_lpci_build.BuildLogAnalyzer.analyze_build_log(
+            str(tmp_path / "missing.log"), "jammy", "amd64"
+        )
+
+
+def send_build_status_event(port, secret, payload, event_type="ci:build:0.1"):
+    """Stand-in for Launchpad's webhook deliveries"""
+    body = rockcraft_lpci_build.json.dumps(payload).encode()
+    signature = rockcraft_lpci_build.hmac.new(
+        secret.encode(), body, rockcraft_lpci_build.hashlib.sha1
+    ).hexdigest()
+    return rockcraft_lpci_build.requests.post(
+        f"http://127.0.0.1:{port}",
+        data=body,
+        headers={
+            "X-Hub-Signature": f"sha1={signature}",
+            "X-Launchpad-Event-Type": event_type,
+        },
+    )
+
+
+class TestBuildStatusReceiver:
+    @pytest.fixture()
+    def receiver(self):
+        receiver = rockcraft_lpci_build.BuildStatusReceiver(0, "secret")
+        receiver.start()
+        yield receiver
+        receiver.stop()
+
+    def test_wait_for_event(self, receiver):
+        assert receiver.wait_for_event(0.01) is None
+
+        for status in ["Currently building", "Successfully built"]:
+            response = send_build_status_event(
+                receiver.port, "secret", {"status": status}
+            )
+            assert response.status_code == 200
+
+        assert receiver.wait_for_event(1) == {"status": "Successfully built"}
+        assert receiver.events.empty()
+
+    def test_invalid_deliveries(self, receiver):
+        response = send_build_status_event(receiver.port, "wrong", {"status": "x"})
+        assert response.status_code == 401
+
+        response = send_build_status_event(
+            receiver.port, "secret", {"status": "x"}, event_type="ping"
+        )
+        assert response.status_code == 200
+        assert receiver.wait_for_event(0.01) is None
+
+    def test_lp_builds_wake_up_on_event(self, mock_builder, mock_atexit):
+        mock_builder.args.webhook_url = "https://example.com/hook"
+        mock_builder.args.webhook_port = 0
+        mock_builder.args.webhook_fallback_poll_interval = 60
+        mock_builder.args.timeout = 60
+        mock_builder.lp_repo = MagicMock()
+        mock_builder.setup_build_status_webhook()
+        receiver = mock_builder.build_status_receiver
+        mock_builder.lp_repo.newWebhook.assert_called_once_with(
+            delivery_url="https://example.com/hook",
+            event_types=["ci:build:0.1"],
+            active=True,
+            secret=receiver.secret,
+        )
+
+        mock_builder.target_build_count = 1
+        mock_builder.lp_repo.getStatusReports.return_value = [
+            MagicMock(ci_build_link="amd64")
+        ]
+        building = MagicMock(
+            arch_tag="amd64",
+            buildstate="Currently building",
+            distro_arch_series_link="ubuntu/jammy/amd64",
+        )
+        built = MagicMock(
+            arch_tag="amd64",
+            buildstate="Successfully built",
+            distro_arch_series_link="ubuntu/jammy/amd64",
+        )
+        mock_builder.launchpad.load.side_effect = [building, built]
+
+        sender = rockcraft_lpci_build.threading.Timer(
+            0.2,
+            send_build_status_event,
+            (receiver.port, receiver.secret, {"status": "Successfully built"}),
+        )
+        sender.start()
+        start = rockcraft_lpci_build.time.monotonic()
+        with patch.object(mock_builder, "save_build_logs"):
+            assert len(mock_builder.wait_for_lp_builds()) == 1
+        # Woken up by the event, way before the fallback poll
+        assert rockcraft_lpci_build.time.monotonic() - start < 10
+        assert mock_builder.lp_repo.getStatusReports.call_count == 2
+
+        mock_builder.keep_lp_repo = True
+        mock_builder.cleanup()
+        mock_builder.lp_webhook.lp_delete.assert_called_once()
+
+
+BUILD_KEYS = itertools.count()
+
+
+def history_record(**kwargs):
+    record = {
+        "build_key": f"build-{next(BUILD_KEYS)}",
+        "rock_name": "rock",
+        "backend": "launchpad",
+        "series": "jammy",
+        "arch": "amd64",
+        "finished_at": "2024-05-02T10:00:00+00:00",
+        "queue_wait": 60.0,
+        "duration": 600.0,
+        "artefact_size": 2**20,
+        "outcome": "success",
+    }
+    record.update(kwargs)
+    return record
+
+
+class TestBuildHistory:
+    @pytest.fixture()
+    def history(self, tmp_path):
+        return rockcraft_lpci_build.BuildHistory(str(tmp_path / "a" / "history.db"))
+
+    def test_expected(self, history):
+        args = ("rock", "launchpad", "jammy", "amd64")
+        assert history.expected("duration", *args) is None
+
+        history.record(
+            [
+                history_record(build_key="timed-out", duration=500.0),
+                history_record(duration=700.0, queue_wait=None),
+                history_record(duration=9000.0, outcome="failure"),
+                history_record(duration=1.0, arch="arm64"),
+            ]
+        )
+        assert history.expected("duration", *args) == 600.0
+        # A resumed run records the builds of the timed-out run again
+        history.record([history_record(build_key="timed-out", duration=500.0)])
+        assert history.expected("duration", *args) == 600.0
+        assert history.expected("queue_wait", *args) == 60.0
+        with pytest.raises(ValueError):
+            history.expected("outcome", *args)
+
+    def test_trends(self, history):
+        history.record(
+            [
+                history_record(),
+                history_record(outcome="failure", artefact_size=0),
+                history_record(rock_name="other"),
+            ]
+        )
+        trends = history.trends("rock")
+        assert len(trends) == 1
+        assert trends[0]["builds"] == 2
+        assert trends[0]["success_rate"] == 50.0
+        assert trends[0]["avg_artefact_size"] == 2**20
+        assert len(history.trends()) == 2
+
+        table = rockcraft_lpci_build.BuildHistory.format_trends(trends)
+        assert re.search(r"rock\s+launchpad\s+jammy\s+amd64\s+2\s+50%\s+60s", table)
+        assert "1MiB" in table
+
+
+class TestBuildHistoryInLpBuilds:
+    @pytest.fixture()
+    def builder(self, mock_builder):
+        mock_builder.args.backend = "launchpad"
+        mock_builder.args.history_overrun_factor = 2.0
+        mock_builder.rock_name = "rock"
+        mock_builder.build_history = MagicMock()
+        return mock_builder
+
+    def ci_build(self, started_ago=None, created_ago=120):
+        now = rockcraft_lpci_build.datetime.now(rockcraft_lpci_build.timezone.utc)
+        return MagicMock(
+            self_link="ci_build/1",
+            distro_arch_series_link="ubuntu/jammy/amd64",
+            buildstate="Successfully built",
+            date_created=now - rockcraft_lpci_build.timedelta(seconds=created_ago),
+            date_started=(
+                now - rockcraft_lpci_build.timedelta(seconds=started_ago)
+                if started_ago is not None
+                else None
+            ),
+            date_finished=None,
+        )
+
+    def test_get_poll_interval(self, builder):
+        builder.build_history.expected.return_value = None
+        assert builder.get_poll_interval([self.ci_build(60)]) == 30
+        # The webhook wakes us up as soon as a build changes
+        builder.build_status_receiver = MagicMock()
+        builder.args.webhook_fallback_poll_interval = 300
+        assert builder.get_poll_interval([self.ci_build(60)]) == 300
+        builder.build_status_receiver = None
+
+        builder.build_history.expected.return_value = 600.0
+        # Far from the expected finish
+        assert builder.get_poll_interval([self.ci_build(0)]) == 300
+        # Getting closer
+        assert 99 <= builder.get_poll_interval([self.ci_build(400)]) <= 100
+        # Overdue
+        assert builder.get_poll_interval([self.ci_build(900)]) == 10
+        # Still queued
+        assert builder.get_poll_interval([self.ci_build(None, 60)]) == 300
+
+    def test_poll_interval_within_timeout(self, builder, mock_atexit):
+        builder.build_history.expected.return_value = None
+        builder.args.timeout = 1
+        builder.target_build_count = 1
+        builder.lp_repo = MagicMock()
+        builder.lp_repo.getStatusReports.return_value = [
+            MagicMock(ci_build_link="amd64")
+        ]
+        ci_build = self.ci_build(60)
+        ci_build.buildstate = "Currently building"
+        builder.launchpad.load.return_value = ci_build
+        with patch.object(builder, "wait_for_next_poll") as wait_for_next_poll:
+            wait_for_next_poll.side_effect = lambda poll_interval: (
+                rockcraft_lpci_build.time.sleep(poll_interval)
+            )
+            with pytest.raises(rockcraft_lpci_build.LaunchpadBuildTimeout):
+                builder.wait_for_lp_builds()
+        # Not the default 30s
+        assert wait_for_next_poll.call_args_list[0].args[0] <= 1
+
+    def test_check_build_overrun(self, builder):
+        builder.build_history.expected.return_value = 600.0
+        assert not builder.check_build_overrun("jammy", "amd64", 1000)
+        assert builder.check_build_overrun("jammy", "amd64", 1300)
+        assert builder.overrunning_builds == {("jammy", "amd64")}
+
+    def test_record_and_save(self, builder, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        builder.build_history = rockcraft_lpci_build.BuildHistory(
+            str(tmp_path / "history.db")
+        )
+        builder.save_build_history()
+        assert not builder.build_history.trends()
+
+        ci_build = self.ci_build(60, 180)
+        ci_build.date_finished = ci_build.date_started
+        builder.record_lp_build(ci_build)
+        # The artefacts are downloaded from the build's status report
+        status_report = MagicMock(
+            ci_build_link="ci_build/1", distro_arch_series_link="ubuntu/jammy/amd64"
+        )
+        with patch.object(
+            builder, "get_artefact_urls", return_value=["url/rock.rock"]
+        ), patch("requests.get") as requests_get:
+            requests_get.return_value.content = bytes(100)
+            builder.download_build_artefacts([status_report])
+        builder.save_build_history()
+        # E.g. --resume
+        builder.save_build_history()
+        trends = builder.build_history.trends()
+        assert trends[0]["builds"] == 1
+        assert 119 <= trends[0]["avg_queue_wait"] <= 121
+        assert trends[0]["avg_duration"] == 0
+        assert trends[0]["avg_artefact_size"] == 100
+        assert trends[0]["last_build"] == ci_build.date_finished.isoformat(
+            timespec="seconds"
+        )
+
+
+class TestPhaseProfiler:
+    def test_disabled(self, tmp_path):
+        profiler = rockcraft_lpci_build.PhaseProfiler(None, 5)
+        with profiler.profile("phase"):
+            pass
+        assert not profiler.phase_runs
+
+    def test_profile(self, tmp_path):
+        profiler = rockcraft_lpci_build.PhaseProfiler(str(tmp_path / "prof"), 5)
+        for _ in range(2):
+            with profiler.profile("phase"):
+                data = [bytes(1024) for _ in range(100)]
+
+        for base in ["phase", "phase-1"]:
+            assert rockcraft_lpci_build.pstats.Stats(
+                str(tmp_path / "prof" / f"{base}.prof")
+            )
+            assert rockcraft_lpci_build.tracemalloc.Snapshot.load(
+                str(tmp_path / "prof" / f"{base}.tracemalloc")
+            )
+            summary = (tmp_path / "prof" / f"{base}.txt").read_text()
+            assert summary.startswith("Phase phase: ")
+            assert "allocation sites" in summary
+
+        assert not rockcraft_lpci_build.tracemalloc.is_tracing()